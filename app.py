@@ -1,16 +1,31 @@
 import os
-import io
 import tempfile
 import shutil
 import subprocess
 import json
+import math
 import base64
-from flask import Flask, request, send_file, jsonify, make_response
+import hashlib
+import threading
+import contextlib
+import atexit
+import select
+import time
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, send_file, jsonify, make_response
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
 
 app = Flask(__name__)
-CORS(app, origins=["https://zenpdf.vercel.app"], supports_credentials=True)
+CORS(
+    app,
+    origins=["https://zenpdf.vercel.app"],
+    supports_credentials=True,
+    expose_headers=["Location", "X-Original-Size", "X-Compressed-Size", "X-Compression-Ratio"],
+)
 
 # Health check
 @app.route("/health")
@@ -21,9 +36,74 @@ def health():
 MAX_UPLOAD_MB = 200
 ALLOWED_EXTENSIONS = {'pdf'}
 GS_BINARY_CANDIDATES = ['gs', 'gswin64c', 'gswin32c']
-MAX_ITERATIONS = 8
 MIN_DPI = 72
+QUALITY_MAP = {
+    'high': {'dpi': 300, 'pdfsettings': '/printer'},
+    'medium': {'dpi': 200, 'pdfsettings': '/printer'},
+    'low': {'dpi': 150, 'pdfsettings': '/ebook'}
+}
 DEFAULT_TIMEOUT = 60
+COPY_CHUNK_SIZE = 1024 * 1024
+B64_CHUNK_SIZE = 3 * 256 * 1024  # multiple of 3 so chunks encode without padding
+GS_WORKERS = min(os.cpu_count() or 1, 4)
+REFINE_ROUNDS = 2
+TARGET_TOLERANCE = 1024 * 10
+TARGET_TOLERANCE_RATIO = 0.02
+CACHE_DIR = "/var/cache/pdfcompress"
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+CACHE_VERSION = 2  # bump when a change outside gs_switches alters gs outputs
+TMPFS_DIR = "/dev/shm"
+SCRATCH_MIN_FREE = 1024 * 1024 * 1024
+GS_MAX_IDLE = GS_WORKERS + 2  # room for servers bound to the other presets
+GS_IDLE_TIMEOUT = 60  # seconds before extra idle gs servers are closed
+GS_FALLBACK_WARN_INTERVAL = 60  # seconds between "resident gs failed" warnings
+JOB_WORKERS = 2
+JOB_MAX_PENDING = 8  # queued + running jobs per worker before POST /jobs answers 503
+JOB_TTL = 60 * 60
+JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+# Werkzeug rejects larger bodies from Content-Length (or while reading them)
+# before any handler code runs.
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({"error": f"File too large. Max allowed {MAX_UPLOAD_MB} MB"}), 413
+
+def find_scratch_root():
+    """Use tmpfs for uploads and gs intermediates when it has room.
+
+    They then never touch the disk. Docker's default 64 MB /dev/shm is too
+    small for MAX_UPLOAD_MB uploads, so fall back to the regular temp dir.
+    make_scratch_dir() repeats the free-space check for every request.
+    """
+    try:
+        if shutil.disk_usage(TMPFS_DIR).free >= SCRATCH_MIN_FREE:
+            root = os.path.join(TMPFS_DIR, "pdfc")
+            os.makedirs(root, exist_ok=True)
+            return root
+    except OSError:
+        pass
+    return tempfile.gettempdir()
+
+SCRATCH_ROOT = find_scratch_root()
+# Job uploads and results wait here for up to JOB_TTL, so keep them on disk
+# rather than in tmpfs RAM. Only gs intermediates go to SCRATCH_ROOT.
+JOBS_ROOT = os.path.join(tempfile.gettempdir(), "pdfc-jobs")
+# Where request dirs go while SCRATCH_ROOT is short of SCRATCH_MIN_FREE.
+DISK_SCRATCH_ROOT = os.path.join(tempfile.gettempdir(), "pdfc-scratch")
+
+def make_scratch_dir():
+    """A private temp dir for one request's upload and gs outputs.
+
+    tmpfs is RAM, so it is only used while it still has SCRATCH_MIN_FREE
+    left; otherwise the dir goes to DISK_SCRATCH_ROOT instead of failing
+    with ENOSPC or pushing the host towards OOM.
+    """
+    with contextlib.suppress(OSError):
+        if shutil.disk_usage(SCRATCH_ROOT).free >= SCRATCH_MIN_FREE:
+            return tempfile.mkdtemp(dir=SCRATCH_ROOT)
+    return tempfile.mkdtemp(dir=DISK_SCRATCH_ROOT)
 
 def find_gs():
     for name in GS_BINARY_CANDIDATES:
@@ -38,20 +118,183 @@ try:
 except Exception:
     GS_BIN = None
 
+_gs_version = None
+
+def gs_version():
+    """`gs --version`, run on first use rather than at import."""
+    global _gs_version
+    if _gs_version is None:
+        _gs_version = subprocess.run(
+            [GS_BIN, "--version"], capture_output=True, text=True, check=True, timeout=DEFAULT_TIMEOUT
+        ).stdout.strip()
+    return _gs_version
+
+# Ghostscript is single-threaded, so target-size searches run several gs
+# processes side by side. Threads are enough: the work happens in the child.
+GS_EXECUTOR = ThreadPoolExecutor(max_workers=GS_WORKERS)
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+JOB_SLOTS = threading.BoundedSemaphore(JOB_MAX_PENDING)
+os.makedirs(JOBS_ROOT, exist_ok=True)
+os.makedirs(DISK_SCRATCH_ROOT, exist_ok=True)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def file_size_mb(file_stream):
-    file_stream.seek(0, os.SEEK_END)
-    size = file_stream.tell()
-    file_stream.seek(0)
-    return size / (1024 * 1024), size
+def save_upload(file_stream, path, hasher=None):
+    """Stream the upload to `path` in bounded chunks, feeding `hasher` if given.
 
-def compress_with_gs(input_path, output_path, dpi, pdfsettings='/printer', timeout=DEFAULT_TIMEOUT):
-    args = [
-        GS_BIN,
-        "-dNOPAUSE",
-        "-dBATCH",
+    One reusable buffer serves both the hash and the write. The bytes have to
+    pass through userspace for hashing anyway, so a kernel copy (sendfile)
+    would only help with the result cache off. Returns the number of bytes
+    written; the size limit is enforced earlier through MAX_CONTENT_LENGTH.
+    """
+    with open(path, "wb") as f:
+        buf = bytearray(COPY_CHUNK_SIZE)
+        view = memoryview(buf)
+        readinto = getattr(file_stream, "readinto", None)
+        written = 0
+        while True:
+            if readinto is not None:
+                n = readinto(buf)
+            else:
+                chunk = file_stream.read(COPY_CHUNK_SIZE)
+                n = len(chunk)
+                view[:n] = chunk
+            if not n:
+                break
+            written += n
+            if hasher is not None:
+                hasher.update(view[:n])
+            f.write(view[:n])
+    return written
+
+class ResultCache:
+    """On-disk LRU of compressed outputs, bounded by total size.
+
+    Gunicorn workers share the directory, so recency lives in file mtimes
+    rather than per-process state: hits touch the file, and stores evict the
+    oldest entries once the directory exceeds `max_bytes`.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.pdf")
+
+    def get(self, key, dest_path):
+        """Copy the entry for `key` to `dest_path`; returns False on a miss.
+
+        The entry is opened here and copied out, so another worker evicting
+        it afterwards cannot pull the file out from under the caller.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as src, open(dest_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(dest_path)
+            return False
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return True
+
+    def put(self, key, src_path):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".pdf"):
+                with contextlib.suppress(OSError):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            total -= size
+
+RESULT_CACHE = None
+try:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if os.access(CACHE_DIR, os.W_OK):
+        RESULT_CACHE = ResultCache(CACHE_DIR, CACHE_MAX_BYTES)
+except OSError:
+    RESULT_CACHE = None
+
+def fixed_ratio(numerator, denominator, digits):
+    """numerator / denominator as a decimal string, ties rounded to even.
+
+    Integer arithmetic only, e.g. fixed_ratio(1, 3, 4) == "0.3333". Ties go
+    to even like float formatting does, so fixed_ratio(13, 80, 3) == "0.162".
+    """
+    scale = 10 ** digits
+    q, r = divmod(numerator * scale, denominator)
+    if 2 * r > denominator or (2 * r == denominator and q % 2):
+        q += 1
+    whole, frac = divmod(q, scale)
+    return f"{whole}.{frac:0{digits}d}"
+
+def stream_pdf_json(pdf_path, metadata, filename):
+    """Stream the JSON response, base64-encoding the PDF straight from disk.
+
+    Produces JSON equivalent to jsonify(success=..., metadata=..., fileData=...,
+    filename=...), though not byte-identical (key order and separators
+    differ), without holding the PDF or its encoding in memory.
+    """
+    head = (json.dumps({"success": True, "metadata": metadata})[:-1] + ', "fileData": "').encode()
+    tail = ('", "filename": ' + json.dumps(filename) + '}').encode()
+    # Opened up front so the body survives the file being unlinked meanwhile.
+    fh = open(pdf_path, "rb")
+    encoded_len = 4 * ((os.fstat(fh.fileno()).st_size + 2) // 3)
+
+    def generate():
+        yield head
+        while True:
+            chunk = fh.read(B64_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+        yield tail
+
+    response = Response(generate(), mimetype="application/json")
+    response.content_length = len(head) + encoded_len + len(tail)
+    response.call_on_close(fh.close)
+    return response
+
+def send_pdf(pdf_path, metadata, filename):
+    """Serve the PDF itself from disk, with the metadata as X- headers."""
+    response = send_file(
+        pdf_path,
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=filename,
+        conditional=True,
+    )
+    response.headers["X-Original-Size"] = str(metadata["originalSize"])
+    response.headers["X-Compressed-Size"] = str(metadata["compressedSize"])
+    response.headers["X-Compression-Ratio"] = fixed_ratio(metadata["compressedSize"], metadata["originalSize"], 4)
+    return response
+
+def gs_switches(pdfsettings):
+    """pdfwrite switches shared by one-shot and persistent gs processes."""
+    return [
         "-dQUIET",
         "-sDEVICE=pdfwrite",
         "-dCompatibilityLevel=1.4",
@@ -63,143 +306,663 @@ def compress_with_gs(input_path, output_path, dpi, pdfsettings='/printer', timeo
         "-dColorImageDownsampleType=/Bicubic",
         "-dGrayImageDownsampleType=/Bicubic",
         "-dMonoImageDownsampleType=/Subsample",
-        f"-dColorImageResolution={int(dpi)}",
-        f"-dGrayImageResolution={int(dpi)}",
-        f"-dMonoImageResolution={int(dpi)}",
         "-dDetectDuplicateImages=true",
         "-dEmbedAllFonts=true",
         "-dSubsetFonts=true",
+    ]
+
+def _nonempty(path):
+    try:
+        return os.path.getsize(path) > 0
+    except OSError:
+        return False
+
+def _ps_string(value):
+    escaped = value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"({escaped})"
+
+class GhostscriptServer:
+    """A resident gs process that takes compression jobs as PostScript on stdin.
+
+    Interpreter startup, resource and font setup and switch parsing happen
+    once. Each job points the pdfwrite device at a new OutputFile, sets the
+    image resolutions, runs the input PDF, then switches to an idle file so
+    the job's output is closed; a per-job token on stdout reports the result.
+    The -dPDFSETTINGS preset can only be applied at startup, so a server is
+    bound to one preset.
+
+    The device's PageCount keeps counting across OutputFiles, and `run`
+    hands it to the PDF interpreter as the page offset for pdfmarks (link
+    and outline targets). Jobs therefore open the document themselves with
+    the offset pinned to 0, so every output numbers its pages from 1.
+    """
+
+    def __init__(self, pdfsettings):
+        self.pdfsettings = pdfsettings
+        self._idle_path = os.path.join(SCRATCH_ROOT, f"gs-idle-{os.getpid()}-{id(self)}.pdf")
+        self._jobs = 0
+        self._buf = b""
+        self.proc = subprocess.Popen(
+            [
+                GS_BIN,
+                "-dNOPAUSE",
+                "-dSAFER",
+                # A trailing "*" covers subdirectories (each request's mkdtemp);
+                # a trailing "/" would only match files directly inside.
+                f"--permit-file-all={os.path.join(SCRATCH_ROOT, '*')}",
+                f"--permit-file-all={os.path.join(DISK_SCRATCH_ROOT, '*')}",
+                f"--permit-file-read={os.path.join(JOBS_ROOT, '*')}",
+                *gs_switches(pdfsettings),
+                # No "-": gs would block-read stdin as a file and run nothing
+                # until the pipe closed. The interactive executive reads it a
+                # line at a time instead; NOPROMPT keeps "GS>" off stdout.
+                "-dNOPROMPT",
+                f"-sOutputFile={self._idle_path}",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def compress(self, input_path, output_path, dpi, timeout):
+        self._jobs += 1
+        token = f"pdfc-job-{self._jobs}"
+        resolutions = " ".join(f"/{kind}ImageResolution {int(dpi)}" for kind in ("Color", "Gray", "Mono"))
+        job = (
+            "{ "
+            f"<< /OutputFile {_ps_string(output_path)} >> setpagedevice "
+            f"<< {resolutions} >> setdistillerparams "
+            f"{_ps_string(input_path)} (r) file << /PageCount 0 >> runpdfbegin_with_params "
+            "/process_trailer_attrs where { pop process_trailer_attrs } if "
+            "1 1 pdfpagecount { pdfgetpage pdfshowpage } for runpdfend "
+            f"<< /OutputFile {_ps_string(self._idle_path)} >> setpagedevice "
+            f"}} stopped {{ ({token} error) }} {{ ({token} ok) }} ifelse = flush\n"
+        )
+        self.proc.stdin.write(job.encode())
+        self.proc.stdin.flush()
+
+        deadline = time.monotonic() + timeout
+        fd = self.proc.stdout.fileno()
+        while True:
+            *lines, self._buf = self._buf.split(b"\n")
+            for line in lines:
+                status = line.decode(errors="replace").strip()
+                if status.startswith(token + " "):
+                    # A file pdfi cannot open only logs an error, so the job
+                    # still reports ok with the empty file setpagedevice made.
+                    if status != token + " ok" or not _nonempty(output_path):
+                        raise subprocess.CalledProcessError(1, self.proc.args)
+                    return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise subprocess.TimeoutExpired(self.proc.args, timeout)
+            data = os.read(fd, 65536)
+            if not data:
+                raise subprocess.CalledProcessError(self.proc.wait(), self.proc.args)
+            self._buf += data
+
+    def close(self, kill=False):
+        """Stop the process; `kill` skips finishing the current output file."""
+        try:
+            if kill:
+                self.proc.kill()
+            else:
+                self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            with contextlib.suppress(OSError):
+                pipe.close()
+        with contextlib.suppress(OSError):
+            os.remove(self._idle_path)
+
+class GhostscriptPool:
+    """Idle GhostscriptServers for reuse across jobs, at most `max_idle` kept.
+
+    A target-size search leaves up to GS_WORKERS servers idle for its
+    preset. Servers idle for `idle_timeout` seconds are closed, except the
+    most recently used one per preset, so a worker settles back to one
+    resident gs per preset between bursts.
+    """
+
+    def __init__(self, max_idle, idle_timeout=GS_IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (server, released_at), oldest first
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._reaper = None
+
+    def acquire(self, pdfsettings):
+        with self._lock:
+            # Newest first, so the extra servers age out.
+            for i in reversed(range(len(self._idle))):
+                server = self._idle[i][0]
+                if server.pdfsettings == pdfsettings:
+                    del self._idle[i]
+                    if server.alive():
+                        return server
+                    server.close(kill=True)  # frees its pipes and idle file
+                    break
+        return GhostscriptServer(pdfsettings)
+
+    def release(self, server):
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+            evicted = [s for s, _ in self._idle[:-self.max_idle]]
+            del self._idle[:-self.max_idle]
+            # Started on first use, so importing the app starts no threads.
+            if self._reaper is None and not self._closed.is_set():
+                self._reaper = threading.Thread(target=self._reap_loop, name="gs-pool-reaper", daemon=True)
+                self._reaper.start()
+        for server in evicted:
+            server.close()
+
+    def _reap_loop(self):
+        while not self._closed.wait(self.idle_timeout / 2):
+            self.reap()
+
+    def reap(self):
+        """Close servers idle past idle_timeout, keeping the newest per preset."""
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._lock:
+            kept, seen = [], set()
+            for server, released_at in reversed(self._idle):
+                if server.pdfsettings in seen and released_at <= cutoff:
+                    expired.append(server)
+                else:
+                    kept.append((server, released_at))
+                seen.add(server.pdfsettings)
+            self._idle = kept[::-1]
+        for server in expired:
+            server.close()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            server.close()
+
+# Persistent servers rely on select() over pipes, hence POSIX only.
+GS_POOL = None
+if GS_BIN is not None and os.name == "posix":
+    GS_POOL = GhostscriptPool(GS_MAX_IDLE)
+    atexit.register(GS_POOL.close)
+
+# One blank 1x1 inch page, used to warm up Ghostscript.
+BLANK_PDF = (
+    b"%PDF-1.4\n"
+    b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n"
+    b"2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n"
+    b"3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 72 72] >>\nendobj\n"
+    b"xref\n0 4\n"
+    b"0000000000 65535 f \n"
+    b"0000000009 00000 n \n"
+    b"0000000058 00000 n \n"
+    b"0000000115 00000 n \n"
+    b"trailer\n<< /Size 4 /Root 1 0 R >>\nstartxref\n184\n%%EOF\n"
+)
+
+def warm_up_gs():
+    """Compress BLANK_PDF once per preset so this worker's first request finds
+    a resident gs with its dictionaries initialised and the font/CMap files
+    in the page cache. Run from gunicorn's post_worker_init hook.
+
+    A gs that cannot run even BLANK_PDF as a resident job would fail every
+    job the same way, so resident servers are then turned off for this
+    worker rather than paying for a server and a one-shot run per pass.
+    """
+    global GS_POOL
+    pool = GS_POOL
+    if pool is None:
+        return
+    tmpdir = make_scratch_dir()
+    try:
+        in_path = os.path.join(tmpdir, "blank.pdf")
+        with open(in_path, "wb") as f:
+            f.write(BLANK_PDF)
+        for pdfsettings in sorted({q['pdfsettings'] for q in QUALITY_MAP.values()}):
+            server = None
+            try:
+                server = pool.acquire(pdfsettings)
+                server.compress(in_path, os.path.join(tmpdir, "out.pdf"), MIN_DPI, DEFAULT_TIMEOUT)
+            except Exception as e:
+                app.logger.warning("Resident gs failed on a blank page (%r); using one-shot gs only", e)
+                if server is not None:
+                    server.close(kill=True)
+                GS_POOL = None
+                pool.close()
+                return
+            pool.release(server)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+_gs_fallback_warned_at = None
+
+def _warn_gs_fallback(exc):
+    """Log a resident-server failure, at most once per GS_FALLBACK_WARN_INTERVAL."""
+    global _gs_fallback_warned_at
+    now = time.monotonic()
+    if _gs_fallback_warned_at is None or now - _gs_fallback_warned_at >= GS_FALLBACK_WARN_INTERVAL:
+        _gs_fallback_warned_at = now
+        app.logger.warning("Resident gs job failed (%r); falling back to one-shot gs", exc)
+
+def compress_with_gs(input_path, output_path, dpi, pdfsettings='/printer', timeout=DEFAULT_TIMEOUT):
+    pool = GS_POOL  # warm_up_gs may turn the pool off meanwhile
+    if pool is not None:
+        server = None
+        try:
+            server = pool.acquire(pdfsettings)
+            server.compress(input_path, output_path, dpi, timeout)
+        except subprocess.TimeoutExpired:
+            server.close(kill=True)
+            raise
+        except Exception as e:
+            # The interpreter may be left mid-job; drop it and fall back to a
+            # one-shot gs run for this job.
+            _warn_gs_fallback(e)
+            if server is not None:
+                server.close(kill=True)
+        else:
+            pool.release(server)
+            return
+
+    args = [
+        GS_BIN,
+        "-dNOPAUSE",
+        "-dBATCH",
+        *gs_switches(pdfsettings),
+        f"-dColorImageResolution={int(dpi)}",
+        f"-dGrayImageResolution={int(dpi)}",
+        f"-dMonoImageResolution={int(dpi)}",
         f"-sOutputFile={output_path}",
         input_path
     ]
     subprocess.run(args, check=True, timeout=timeout)
 
-@app.route("/compress", methods=["POST"])
-def compress_endpoint():
+def _gs_job(in_path, tmpdir, dpi, pdfsettings):
+    out_path = os.path.join(tmpdir, f"out_{dpi}.pdf")
+    compress_with_gs(in_path, out_path, dpi, pdfsettings=pdfsettings)
+    size = os.path.getsize(out_path)
+    if size == 0:
+        raise RuntimeError(f"Ghostscript wrote an empty file at {dpi} dpi")
+    return dpi, out_path, size
+
+def run_candidates(in_path, tmpdir, dpis, pdfsettings):
+    """Compress at each DPI concurrently; failed runs are dropped."""
+    futures = [GS_EXECUTOR.submit(_gs_job, in_path, tmpdir, dpi, pdfsettings) for dpi in dpis]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception:
+            pass
+    return results
+
+def search_target_dpi(in_path, tmpdir, start_dpi, pdfsettings, target_bytes):
+    """Find the gs output closest to `target_bytes`.
+
+    Output size grows roughly with dpi**2, so a probe at `start_dpi` predicts
+    the DPI that hits the target and one more run verifies it. Only when that
+    misses do we refine inside the bracket, evaluating points in parallel.
+    Results within max(TARGET_TOLERANCE, TARGET_TOLERANCE_RATIO * target) are
+    accepted. Returns (dpi, out_path), or None if every run failed.
+    """
+    tolerance = max(TARGET_TOLERANCE, int(target_bytes * TARGET_TOLERANCE_RATIO))
+    tried = {}
+
+    def closest():
+        return min(tried, key=lambda dpi: abs(tried[dpi][1] - target_bytes))
+
+    def run(dpis):
+        for dpi, out_path, size in run_candidates(in_path, tmpdir, dpis, pdfsettings):
+            tried[dpi] = (out_path, size)
+        # Only the closest output can be returned, so delete the others now
+        # rather than holding every candidate (in tmpfs RAM) until cleanup.
+        if tried:
+            best = closest()
+            for dpi, (out_path, size) in tried.items():
+                if dpi != best and out_path is not None:
+                    with contextlib.suppress(OSError):
+                        os.remove(out_path)
+                    tried[dpi] = (None, size)
+
+    run([start_dpi])
+    if not tried:
+        return None
+    probe_size = tried[start_dpi][1]
+    if probe_size > target_bytes + tolerance:
+        predicted = int(start_dpi * math.sqrt(target_bytes / probe_size))
+        run([max(MIN_DPI, min(predicted, start_dpi - 1))])
+
+    for _ in range(REFINE_ROUNDS):
+        if abs(tried[closest()][1] - target_bytes) <= tolerance:
+            break
+
+        under = [dpi for dpi, (_, size) in tried.items() if size <= target_bytes]
+        over = [dpi for dpi, (_, size) in tried.items() if size > target_bytes]
+        if not over:
+            break  # even start_dpi fits; nothing higher to try
+        if under:
+            low, high = sorted((max(under), min(over)))
+            dpis = set()
+        elif MIN_DPI not in tried:
+            low, high = MIN_DPI, min(over)
+            dpis = {MIN_DPI}
+        else:
+            break  # even MIN_DPI is over target
+        step = (high - low) / (GS_WORKERS + 1)
+        dpis |= {int(low + step * i) for i in range(1, GS_WORKERS + 1)}
+        dpis = sorted(dpis - tried.keys())
+        if not dpis:
+            break
+        run(dpis)
+    best_dpi = closest()
+    return best_dpi, tried[best_dpi][0]
+
+def parse_compress_form():
+    """Validate an upload form; returns (file, filename, opts, error_response)."""
     if GS_BIN is None:
-        return jsonify({"error": "Ghostscript not available on server"}), 500
+        return None, None, None, (jsonify({"error": "Ghostscript not available on server"}), 500)
 
     if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
+        return None, None, None, (jsonify({"error": "No file part"}), 400)
 
     file = request.files['file']
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return None, None, None, (jsonify({"error": "No selected file"}), 400)
 
     if not allowed_file(file.filename):
-        return jsonify({"error": "Invalid file type; PDF required"}), 400
-
-    mb, orig_bytes = file_size_mb(file.stream)
-    if mb > MAX_UPLOAD_MB:
-        return jsonify({"error": f"File too large. Max allowed {MAX_UPLOAD_MB} MB"}), 400
+        return None, None, None, (jsonify({"error": "Invalid file type; PDF required"}), 400)
 
     quality = request.form.get('quality', 'high').lower()
-    if quality not in ('high', 'medium', 'low'):
+    if quality not in QUALITY_MAP:
         quality = 'high'
 
     target_size_mb = request.form.get('targetSizeMB')
     try:
         target_size_mb = float(target_size_mb) if target_size_mb else None
     except:
-        return jsonify({"error": "Invalid targetSizeMB"}), 400
+        return None, None, None, (jsonify({"error": "Invalid targetSizeMB"}), 400)
+    if target_size_mb is not None and not (math.isfinite(target_size_mb) and target_size_mb > 0):
+        return None, None, None, (jsonify({"error": "Invalid targetSizeMB"}), 400)
 
-    quality_map = {
-        'high': {'dpi': 300, 'pdfsettings': '/prepress'},
-        'medium': {'dpi': 200, 'pdfsettings': '/printer'},
-        'low': {'dpi': 150, 'pdfsettings': '/ebook'}
+    opts = {
+        "quality": quality,
+        "target_size_mb": target_size_mb,
+        "start_dpi": QUALITY_MAP[quality]['dpi'],
+        "pdfsettings": QUALITY_MAP[quality]['pdfsettings'],
     }
-    start_dpi = quality_map[quality]['dpi']
-    pdfsettings = quality_map[quality]['pdfsettings']
-    filename = secure_filename(file.filename)
+    return file, secure_filename(file.filename), opts, None
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        in_path = os.path.join(tmpdir, filename)
-        file.stream.seek(0)
-        with open(in_path, "wb") as f:
-            f.write(file.stream.read())
+def save_request_file(file, workdir):
+    """Save the upload into `workdir`; returns (in_path, orig_bytes, digest).
 
-        # Single pass compression
-        if target_size_mb is None or target_size_mb >= mb:
-            out_path = os.path.join(tmpdir, f"compressed_{filename}")
-            try:
-                compress_with_gs(in_path, out_path, start_dpi, pdfsettings=pdfsettings)
-            except Exception as e:
-                return jsonify({"error": "Compression error", "details": str(e)}), 500
-
-            with open(out_path, "rb") as fh:
-                compressed_bytes = fh.read()
-            compressed_size = len(compressed_bytes)
-
-            # Return JSON with file data and metadata
-            return jsonify({
-                "success": True,
-                "metadata": {
-                    "originalSize": orig_bytes,
-                    "compressedSize": compressed_size,
-                    "compressionRatio": f"{(compressed_size / orig_bytes * 100):.1f}%",
-                    "qualityUsed": quality,
-                    "targetSizeUsed": target_size_mb
-                },
-                "fileData": base64.b64encode(compressed_bytes).decode('utf-8'),
-                "filename": f"compressed_{filename}"
-            })
+    The upload gets a fixed name: gs outputs share the directory, and a
+    client-chosen name such as out_300.pdf would have gs overwrite its own
+    input. digest is only computed when the result cache is enabled.
+    """
+    in_path = os.path.join(workdir, "input.pdf")
+    hasher = hashlib.blake2b(digest_size=20) if RESULT_CACHE else None
+    orig_bytes = save_upload(file.stream, in_path, hasher)
+    return in_path, orig_bytes, hasher.hexdigest() if hasher else None
+
+@app.route("/compress", methods=["POST"])
+def compress_endpoint():
+    file, filename, opts, error = parse_compress_form()
+    if error:
+        return error
+
+    # The response body is streamed from files in tmpdir, so it is removed
+    # once the response is closed rather than when this function returns.
+    tmpdir = make_scratch_dir()
+    try:
+        response = make_response(compress_upload(file, tmpdir, filename, opts))
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+    response.call_on_close(lambda: shutil.rmtree(tmpdir, ignore_errors=True))
+    return response
 
+def compress_file(in_path, tmpdir, filename, orig_bytes, target_size_mb, start_dpi, pdfsettings):
+    """Run Ghostscript on `in_path` and return the path of the chosen output.
+
+    Returns `in_path` itself when gs could not make the file any smaller.
+    """
+    if target_size_mb is None:
+        # Single pass compression
+        out_path = os.path.join(tmpdir, f"compressed_{filename}")
+        compress_with_gs(in_path, out_path, start_dpi, pdfsettings=pdfsettings)
+    else:
         # Iterative compression (target size)
-        low = MIN_DPI
-        high = start_dpi
-        best_candidate = None
-        best_size_diff = float('inf')
-        best_dpi = None
         target_bytes = int(target_size_mb * 1024 * 1024)
+        result = search_target_dpi(in_path, tmpdir, start_dpi, pdfsettings, target_bytes)
+        if result is not None:
+            out_path = result[1]
+        else:
+            out_path = os.path.join(tmpdir, f"fallback_{filename}")
+            compress_with_gs(in_path, out_path, MIN_DPI, pdfsettings=pdfsettings)
 
-        for i in range(MAX_ITERATIONS):
-            mid = (low + high) / 2.0
-            out_path = os.path.join(tmpdir, f"out_{int(mid)}.pdf")
-            try:
-                compress_with_gs(in_path, out_path, mid, pdfsettings=pdfsettings)
-            except Exception:
-                break
+    # Born-digital PDFs often come out larger after a pdfwrite round trip.
+    if os.path.getsize(out_path) >= orig_bytes:
+        return in_path
+    return out_path
 
-            candidate_size = os.path.getsize(out_path)
-            diff = candidate_size - target_bytes
-            if abs(diff) < best_size_diff:
-                best_size_diff = abs(diff)
-                best_candidate = out_path
-                best_dpi = int(mid)
-            if abs(diff) <= 1024 * 10:
-                break
-            if candidate_size > target_bytes:
-                high = mid
-            else:
-                low = mid
-            if (high - low) < 1.0:
-                break
+def result_cache_key(digest, start_dpi, pdfsettings, target_size_mb):
+    """The RESULT_CACHE key for one compression, or None to bypass the cache.
 
-        if best_candidate is None:
-            fallback_out = os.path.join(tmpdir, f"fallback_{filename}")
-            try:
-                compress_with_gs(in_path, fallback_out, MIN_DPI, pdfsettings=pdfsettings)
-                best_candidate = fallback_out
-                best_dpi = MIN_DPI
-            except Exception as e:
-                return jsonify({"error": "Compression failed", "details": str(e)}), 500
-
-        with open(best_candidate, "rb") as fh:
-            compressed_bytes = fh.read()
-        compressed_size = len(compressed_bytes)
-
-        return jsonify({
-            "success": True,
-            "metadata": {
-                "originalSize": orig_bytes,
-                "compressedSize": compressed_size,
-                "compressionRatio": f"{(compressed_size / orig_bytes * 100):.1f}%",
-                "qualityUsed": quality,
-                "targetSizeUsed": target_size_mb
-            },
-            "fileData": base64.b64encode(compressed_bytes).decode('utf-8'),
+    Entries outlive deploys, so the key is salted with CACHE_VERSION, the gs
+    version and the switch set; an upgrade or a gs_switches change then
+    misses instead of serving outputs made the old way.
+    """
+    try:
+        version = gs_version()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    salt = hashlib.blake2b(
+        repr((CACHE_VERSION, version, gs_switches(pdfsettings))).encode(), digest_size=8
+    ).hexdigest()
+    return f"{digest}-{start_dpi}-{pdfsettings.strip('/')}-{target_size_mb}-{salt}"
+
+def compress_job(in_path, tmpdir, filename, orig_bytes, digest, opts):
+    """Compress a saved upload, going through the result cache.
+
+    Returns (out_path, metadata); raises if Ghostscript fails.
+    """
+    target_size_mb = opts["target_size_mb"]
+    start_dpi = opts["start_dpi"]
+    pdfsettings = opts["pdfsettings"]
+
+    out_path = None
+    cache_key = None
+    if target_size_mb is not None and target_size_mb * 1024 * 1024 >= orig_bytes:
+        out_path = in_path  # already within the target; nothing for gs to do
+    elif RESULT_CACHE and digest:
+        cache_key = result_cache_key(digest, start_dpi, pdfsettings, target_size_mb)
+        cached_path = os.path.join(tmpdir, f"cached_{filename}")
+        if cache_key is not None and RESULT_CACHE.get(cache_key, cached_path):
+            out_path = cached_path
+
+    if out_path is None:
+        out_path = compress_file(
+            in_path, tmpdir, filename, orig_bytes, target_size_mb, start_dpi, pdfsettings
+        )
+        # An empty output is a gs failure; caching it would hand it to every
+        # later upload of the same bytes.
+        if cache_key is not None and os.path.getsize(out_path) > 0:
+            RESULT_CACHE.put(cache_key, out_path)
+
+    compressed_size = os.path.getsize(out_path)
+    return out_path, {
+        "originalSize": orig_bytes,
+        "compressedSize": compressed_size,
+        "compressionRatio": fixed_ratio(compressed_size * 100, orig_bytes, 1) + "%",
+        "qualityUsed": opts["quality"],
+        "targetSizeUsed": target_size_mb
+    }
+
+def compress_upload(file, tmpdir, filename, opts):
+    in_path, orig_bytes, digest = save_request_file(file, tmpdir)
+
+    try:
+        out_path, metadata = compress_job(in_path, tmpdir, filename, orig_bytes, digest, opts)
+    except Exception as e:
+        return jsonify({"error": "Compression failed", "details": str(e)}), 500
+
+    # Return JSON with file data and metadata
+    return stream_pdf_json(out_path, metadata, f"compressed_{filename}")
+
+# Async jobs: POST /jobs answers 202 right away and the compression runs on
+# JOB_EXECUTOR. State lives in JOBS_ROOT/<id>/status.json so any gunicorn
+# worker can answer GET /jobs/<id> and GET /result/<id>. Pending jobs record
+# the worker running them, so a job whose worker died (restart, OOM kill)
+# reads as failed instead of staying queued forever.
+
+def _job_dir(job_id):
+    if not JOB_ID_RE.fullmatch(job_id):
+        return None
+    return os.path.join(JOBS_ROOT, job_id)
+
+def _proc_start_time(pid):
+    """Start time of `pid` in clock ticks since boot, or None if unknown.
+
+    JOBS_ROOT survives container restarts and the new workers usually get
+    the same small pids, so a pid alone cannot tell them apart.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as fh:
+            stat = fh.read()
+    except OSError:
+        return None
+    # Field 22; the command name (field 2) may itself contain spaces or ")".
+    return int(stat[stat.rindex(b")") + 2:].split()[19])
+
+def _worker():
+    """What a pending status.json records about the worker running the job."""
+    pid = os.getpid()
+    return {"pid": pid, "started": _proc_start_time(pid)}
+
+def _worker_alive(pid, started):
+    if os.name != "posix":
+        return True  # os.kill(pid, 0) terminates the process on Windows
+    if started is not None:
+        return _proc_start_time(pid) == started
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists but belongs to another user
+    return True
+
+def read_job_status(job_dir):
+    try:
+        with open(os.path.join(job_dir, "status.json")) as fh:
+            status = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    pid = status.pop("pid", None)
+    started = status.pop("started", None)
+    if status["status"] in ("queued", "running") and pid is not None and not _worker_alive(pid, started):
+        return {"status": "failed", "error": "Compression failed", "details": "Worker exited before the job finished"}
+    return status
+
+def write_job_status(job_dir, status):
+    path = os.path.join(job_dir, "status.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(status, fh)
+    os.replace(tmp_path, path)
+
+def sweep_jobs():
+    """Remove job directories older than JOB_TTL."""
+    cutoff = time.time() - JOB_TTL
+    with contextlib.suppress(OSError):
+        for entry in os.scandir(JOBS_ROOT):
+            with contextlib.suppress(OSError):
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+def run_job(job_dir, in_path, filename, orig_bytes, digest, opts):
+    tmpdir = None
+    try:
+        # Inside the try so a failed write still frees the slot and workdir.
+        write_job_status(job_dir, {"status": "running", **_worker()})
+        tmpdir = make_scratch_dir()
+        out_path, metadata = compress_job(in_path, tmpdir, filename, orig_bytes, digest, opts)
+        # Copies out of tmpfs, or just renames when out_path is the input.
+        shutil.move(out_path, os.path.join(job_dir, "result.pdf"))
+    except Exception as e:
+        write_job_status(job_dir, {"status": "failed", "error": "Compression failed", "details": str(e)})
+    else:
+        write_job_status(job_dir, {
+            "status": "done",
+            "metadata": metadata,
             "filename": f"compressed_{filename}"
         })
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        shutil.rmtree(os.path.dirname(in_path), ignore_errors=True)
+        JOB_SLOTS.release()
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    # Checked before the form is parsed, so a full queue never spools uploads.
+    if not JOB_SLOTS.acquire(blocking=False):
+        return jsonify({"error": "Too many jobs in progress, try again later"}), 503, {"Retry-After": "10"}
+
+    queued = False
+    job_dir = None
+    try:
+        file, filename, opts, error = parse_compress_form()
+        if error:
+            return error
+
+        sweep_jobs()
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(JOBS_ROOT, job_id)
+        workdir = os.path.join(job_dir, "work")
+        os.makedirs(workdir)
+        in_path, orig_bytes, digest = save_request_file(file, workdir)
+
+        write_job_status(job_dir, {"status": "queued", **_worker()})
+        JOB_EXECUTOR.submit(run_job, job_dir, in_path, filename, orig_bytes, digest, opts)
+        queued = True
+    finally:
+        # run_job releases the slot and cleans up once the job is queued.
+        if not queued:
+            if job_dir is not None:
+                shutil.rmtree(job_dir, ignore_errors=True)
+            JOB_SLOTS.release()
+    return jsonify({"jobId": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job_dir = _job_dir(job_id)
+    status = read_job_status(job_dir) if job_dir else None
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"jobId": job_id, **status})
+
+@app.route("/result/<job_id>")
+def job_result(job_id):
+    job_dir = _job_dir(job_id)
+    status = read_job_status(job_dir) if job_dir else None
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if status["status"] == "failed":
+        return jsonify({"jobId": job_id, **status}), 500
+    if status["status"] != "done":
+        return jsonify({"jobId": job_id, **status}), 202
+
+    return send_pdf(os.path.join(job_dir, "result.pdf"), status["metadata"], status["filename"])
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=False)
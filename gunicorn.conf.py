@@ -0,0 +1,12 @@
+# Gunicorn settings; the Dockerfile starts gunicorn with -c gunicorn.conf.py.
+import threading
+
+
+def post_worker_init(worker):
+    # Runs in each worker after it has loaded the app, so resident gs
+    # servers are never shared across a fork (even with --preload). The
+    # warm-up runs in the background to keep the first accept() prompt.
+    import app
+
+    if app.GS_BIN is not None:
+        threading.Thread(target=app.warm_up_gs, name="gs-warm-up", daemon=True).start()
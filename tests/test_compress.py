@@ -0,0 +1,92 @@
+import base64
+import io
+import json
+import os
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def scratch_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "SCRATCH_ROOT", str(tmp_path))
+    monkeypatch.setattr(app, "DISK_SCRATCH_ROOT", str(tmp_path))
+    monkeypatch.setattr(app, "SCRATCH_MIN_FREE", 0)
+    return tmp_path
+
+
+@pytest.fixture
+def stub_gs(monkeypatch, scratch_root):
+    """Replace gs with a stub that writes `size` bytes; returns a setter."""
+    monkeypatch.setattr(app, "GS_BIN", "gs")
+    monkeypatch.setattr(app, "RESULT_CACHE", None)
+    sizes = {}
+
+    def compress_with_gs(input_path, output_path, dpi, pdfsettings="/printer", timeout=app.DEFAULT_TIMEOUT):
+        with open(output_path, "wb") as fh:
+            fh.write(bytes(i % 251 for i in range(sizes["out"])))
+
+    monkeypatch.setattr(app, "compress_with_gs", compress_with_gs)
+
+    def install(out_size):
+        sizes["out"] = out_size
+
+    return install
+
+
+def post_compress(data):
+    return app.app.test_client().post(
+        "/compress",
+        data={"file": (io.BytesIO(data), "x.pdf"), "quality": "medium"},
+        content_type="multipart/form-data",
+    )
+
+
+@pytest.mark.parametrize("out_size", [
+    app.B64_CHUNK_SIZE + 1,
+    2 * app.B64_CHUNK_SIZE + 2,
+])
+def test_compress_streams_json_with_exact_length(stub_gs, scratch_root, out_size):
+    stub_gs(out_size)
+    upload = b"%PDF-1.4\n" + b"x" * (3 * app.B64_CHUNK_SIZE)
+    with post_compress(upload) as response:
+        assert response.status_code == 200
+        body = response.get_data()
+        assert len(body) == int(response.headers["Content-Length"])
+        # The body streams from the scratch dir until the response is closed.
+        assert len(os.listdir(scratch_root)) == 1
+    assert os.listdir(scratch_root) == []
+
+    payload = json.loads(body)
+    expected = bytes(i % 251 for i in range(out_size))
+    assert base64.b64decode(payload.pop("fileData")) == expected
+    assert payload == {
+        "success": True,
+        "metadata": {
+            "originalSize": len(upload),
+            "compressedSize": out_size,
+            "compressionRatio": app.fixed_ratio(out_size * 100, len(upload), 1) + "%",
+            "qualityUsed": "medium",
+            "targetSizeUsed": None,
+        },
+        "filename": "compressed_x.pdf",
+    }
+
+
+def test_compress_returns_original_when_gs_output_is_larger(stub_gs):
+    upload = b"%PDF-1.4\n" + b"x" * 1000
+    stub_gs(2 * len(upload))
+    with post_compress(upload) as response:
+        assert response.status_code == 200
+        payload = json.loads(response.get_data())
+    assert payload["metadata"]["compressedSize"] == payload["metadata"]["originalSize"] == len(upload)
+    assert base64.b64decode(payload["fileData"]) == upload
+
+
+def test_compress_rejects_upload_over_limit(stub_gs, monkeypatch):
+    stub_gs(10)
+    monkeypatch.setitem(app.app.config, "MAX_CONTENT_LENGTH", 1024)
+    with post_compress(b"%PDF-1.4\n" + b"x" * 2048) as response:
+        assert response.status_code == 413
+        assert response.get_json() == {"error": f"File too large. Max allowed {app.MAX_UPLOAD_MB} MB"}
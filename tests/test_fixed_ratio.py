@@ -0,0 +1,25 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("numerator, denominator, digits, expected", [
+    (1, 3, 4, "0.3333"),
+    (2, 3, 4, "0.6667"),
+    (0, 7, 1, "0.0"),
+    (7, 7, 4, "1.0000"),
+    (1300, 80, 1, "16.2"),  # exact tie: to even, like the old float formatting
+    (1500, 80, 1, "18.8"),
+    (13, 80, 3, "0.162"),
+])
+def test_fixed_ratio(numerator, denominator, digits, expected):
+    assert app.fixed_ratio(numerator, denominator, digits) == expected
+
+
+def test_fixed_ratio_matches_float_formatting_off_ties():
+    for orig in (97, 1000, 3000009):
+        for compressed in range(0, orig + 1, max(1, orig // 997)):
+            exact = compressed * 1000 % orig
+            if 2 * exact == orig:
+                continue  # a float tie goes whichever way its rounding error points
+            assert app.fixed_ratio(compressed * 100, orig, 1) == f"{compressed / orig * 100:.1f}"
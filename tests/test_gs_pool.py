@@ -0,0 +1,80 @@
+import logging
+import subprocess
+
+import pytest
+
+import app
+
+
+class StubServer:
+    def __init__(self, pdfsettings, alive=True, fail=False):
+        self.pdfsettings = pdfsettings
+        self._alive = alive
+        self._fail = fail
+        self.closed = False
+
+    def alive(self):
+        return self._alive
+
+    def compress(self, input_path, output_path, dpi, timeout):
+        if self._fail:
+            raise subprocess.CalledProcessError(1, "gs")
+
+    def close(self, kill=False):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(app, "GhostscriptServer", StubServer)
+    pool = app.GhostscriptPool(4)
+    monkeypatch.setattr(app, "GS_POOL", pool)
+    yield pool
+    pool.close()
+
+
+def test_acquire_closes_dead_server(pool):
+    dead = StubServer("/printer", alive=False)
+    pool.release(dead)
+    server = pool.acquire("/printer")
+    assert server is not dead
+    assert dead.closed
+
+
+def test_fallback_warns_once_per_interval(pool, monkeypatch, caplog):
+    monkeypatch.setattr(app, "_gs_fallback_warned_at", None)
+    runs = []
+    monkeypatch.setattr(app.subprocess, "run", lambda args, **kw: runs.append(args))
+    for _ in range(3):
+        pool.release(StubServer("/printer", fail=True))
+        with caplog.at_level(logging.WARNING, logger=app.app.logger.name):
+            app.compress_with_gs("in.pdf", "out.pdf", 150)
+    assert len(runs) == 3
+    warnings = [r for r in caplog.records if "falling back to one-shot gs" in r.getMessage()]
+    assert len(warnings) == 1
+
+
+def test_warm_up_returns_servers_to_pool(pool):
+    app.warm_up_gs()
+    presets = sorted({q["pdfsettings"] for q in app.QUALITY_MAP.values()})
+    assert sorted(server.pdfsettings for server, _ in pool._idle) == presets
+
+
+def test_warm_up_turns_pool_off_when_resident_gs_fails(pool, monkeypatch):
+    monkeypatch.setattr(app, "GhostscriptServer", lambda pdfsettings: StubServer(pdfsettings, fail=True))
+    app.warm_up_gs()
+    assert app.GS_POOL is None
+    assert pool._idle == []
+
+
+def test_reap_keeps_newest_server_per_preset(pool):
+    servers = [StubServer(p) for p in ("/printer", "/printer", "/printer", "/ebook")]
+    for server in servers:
+        pool.release(server)
+    pool.reap()
+    assert not any(server.closed for server in servers)
+
+    pool.idle_timeout = 0
+    pool.reap()
+    assert [server.closed for server in servers] == [True, True, False, False]
+    assert pool.acquire("/printer") is servers[2]
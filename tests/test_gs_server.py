@@ -0,0 +1,138 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+import pytest
+
+import app
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("gs") is None or os.name != "posix",
+    reason="needs a real Ghostscript and POSIX pipes",
+)
+
+
+def build_pdf(objects):
+    """Serialise numbered object bodies (1-based, object 1 the catalog)."""
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+# Two pages; page 1 carries a link to page 2 and the outline points there too.
+LINKED_PDF = build_pdf([
+    "<< /Type /Catalog /Pages 2 0 R /Outlines 6 0 R >>",
+    "<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 >>",
+    "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Annots [5 0 R] >>",
+    "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] >>",
+    "<< /Type /Annot /Subtype /Link /Rect [10 10 100 100] /Border [0 0 0] /Dest [4 0 R /Fit] >>",
+    "<< /Type /Outlines /First 7 0 R /Last 7 0 R /Count 1 >>",
+    "<< /Title (Page 2) /Parent 6 0 R /Dest [4 0 R /Fit] >>",
+])
+
+
+def link_targets(path):
+    """0-based page indices of every explicit destination in a pdfwrite output."""
+    with open(path, "rb") as fh:
+        data = fh.read().decode("latin-1")
+    objects = dict(re.findall(r"(\d+) 0 obj(.*?)endobj", data, re.S))
+    pages = next(
+        re.findall(r"(\d+) 0 R", re.search(r"/Kids\s*\[([^\]]*)\]", body).group(1))
+        for body in objects.values()
+        if re.search(r"/Type\s*/Pages\b", body)
+    )
+    dests = re.findall(r"\[\s*(\d+)\s+0\s+R\s*/(?:XYZ|Fit\w*)", data)
+    return sorted(pages.index(num) for num in dests)
+
+
+@pytest.fixture
+def scratch():
+    # Resident servers may only touch files under SCRATCH_ROOT.
+    path = tempfile.mkdtemp(dir=app.SCRATCH_ROOT)
+    yield Path(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def test_resident_server_keeps_link_targets(scratch, monkeypatch):
+    blank = scratch / "blank.pdf"
+    blank.write_bytes(app.BLANK_PDF)
+    linked = scratch / "linked.pdf"
+    linked.write_bytes(LINKED_PDF)
+
+    one_shot = scratch / "one_shot.pdf"
+    with monkeypatch.context() as m:
+        m.setattr(app, "GS_POOL", None)
+        app.compress_with_gs(str(linked), str(one_shot), 150)
+    assert link_targets(one_shot) == [1, 1]
+
+    server = app.GhostscriptServer("/printer")
+    try:
+        # Earlier jobs advance the device's PageCount, as the warm-up does.
+        server.compress(str(blank), str(scratch / "warm.pdf"), 150, app.DEFAULT_TIMEOUT)
+        for i in range(2):
+            out = scratch / f"resident_{i}.pdf"
+            server.compress(str(linked), str(out), 150, app.DEFAULT_TIMEOUT)
+            assert link_targets(out) == link_targets(one_shot)
+    finally:
+        server.close()
+
+
+def test_warm_up_leaves_one_idle_server_per_preset(monkeypatch):
+    pool = app.GhostscriptPool(app.GS_MAX_IDLE)
+    monkeypatch.setattr(app, "GS_POOL", pool)
+    try:
+        app.warm_up_gs()
+        presets = sorted({q["pdfsettings"] for q in app.QUALITY_MAP.values()})
+        assert sorted(server.pdfsettings for server, _ in pool._idle) == presets
+        assert all(server.alive() for server, _ in pool._idle)
+    finally:
+        pool.close()
+
+
+def test_compress_with_gs_stays_resident(scratch, monkeypatch):
+    pool = app.GhostscriptPool(app.GS_MAX_IDLE)
+    monkeypatch.setattr(app, "GS_POOL", pool)
+
+    def no_fallback(args, **kwargs):
+        raise AssertionError("fell back to one-shot gs")
+
+    monkeypatch.setattr(app.subprocess, "run", no_fallback)
+    linked = scratch / "linked.pdf"
+    linked.write_bytes(LINKED_PDF)
+    try:
+        for dpi in (150, 100):
+            out = scratch / f"out_{dpi}.pdf"
+            app.compress_with_gs(str(linked), str(out), dpi)
+            assert link_targets(out) == [1, 1]
+        assert len(pool._idle) == 1
+    finally:
+        pool.close()
+
+
+def test_non_pdf_input_is_an_error(scratch, monkeypatch):
+    pool = app.GhostscriptPool(app.GS_MAX_IDLE)
+    monkeypatch.setattr(app, "GS_POOL", pool)
+    text = scratch / "g.pdf"
+    text.write_bytes(b"not a pdf\n" * 100)
+    try:
+        server = app.GhostscriptServer("/printer")
+        try:
+            with pytest.raises(subprocess.CalledProcessError):
+                server.compress(str(text), str(scratch / "resident.pdf"), 150, app.DEFAULT_TIMEOUT)
+        finally:
+            server.close()
+        with pytest.raises(subprocess.CalledProcessError):
+            app.compress_with_gs(str(text), str(scratch / "out.pdf"), 150)
+    finally:
+        pool.close()
@@ -0,0 +1,117 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def jobs_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "JOBS_ROOT", str(tmp_path))
+    return tmp_path
+
+
+def test_submit_answers_503_when_queue_is_full(jobs_root, monkeypatch):
+    monkeypatch.setattr(app, "GS_BIN", "gs")
+    monkeypatch.setattr(app, "JOB_SLOTS", threading.BoundedSemaphore(1))
+    app.JOB_SLOTS.acquire()
+
+    response = app.app.test_client().post(
+        "/jobs",
+        data={"file": (io.BytesIO(b"%PDF-1.4\n"), "x.pdf")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    assert os.listdir(jobs_root) == []
+
+
+def test_submit_releases_slot_on_invalid_form(jobs_root, monkeypatch):
+    monkeypatch.setattr(app, "GS_BIN", "gs")
+    monkeypatch.setattr(app, "JOB_SLOTS", threading.BoundedSemaphore(1))
+
+    response = app.app.test_client().post("/jobs", data={}, content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert app.JOB_SLOTS.acquire(blocking=False)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="pid liveness is POSIX only")
+@pytest.mark.parametrize("state", ["queued", "running"])
+def test_job_of_exited_worker_reads_as_failed(jobs_root, state):
+    worker = subprocess.Popen([sys.executable, "-c", "pass"])
+    worker.wait()
+    job_id = "0" * 32
+    job_dir = jobs_root / job_id
+    job_dir.mkdir()
+    app.write_job_status(str(job_dir), {"status": state, "pid": worker.pid})
+
+    client = app.app.test_client()
+    status = client.get(f"/jobs/{job_id}").get_json()
+    assert status["status"] == "failed"
+    assert "pid" not in status
+    assert client.get(f"/result/{job_id}").status_code == 500
+
+
+def test_job_of_live_worker_stays_pending(jobs_root):
+    job_id = "1" * 32
+    job_dir = jobs_root / job_id
+    job_dir.mkdir()
+    app.write_job_status(str(job_dir), {"status": "running", **app._worker()})
+
+    response = app.app.test_client().get(f"/result/{job_id}")
+    assert response.status_code == 202
+    assert response.get_json() == {"jobId": job_id, "status": "running"}
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_job_of_reused_pid_reads_as_failed(jobs_root):
+    # After a restart a new worker may have the dead one's pid; its start
+    # time still differs.
+    job_id = "2" * 32
+    job_dir = jobs_root / job_id
+    job_dir.mkdir()
+    worker = app._worker()
+    app.write_job_status(str(job_dir), {"status": "running", "pid": worker["pid"], "started": worker["started"] - 1})
+
+    status = app.app.test_client().get(f"/jobs/{job_id}").get_json()
+    assert status["status"] == "failed"
+    assert "started" not in status
+
+
+def test_run_job_frees_slot_when_status_write_fails(jobs_root, monkeypatch):
+    monkeypatch.setattr(app, "JOB_SLOTS", threading.BoundedSemaphore(1))
+    app.JOB_SLOTS.acquire()
+    workdir = jobs_root / "upload"
+    workdir.mkdir()
+    in_path = workdir / "x.pdf"
+    in_path.write_bytes(b"%PDF-1.4\n")
+
+    # The job dir was swept, so every status write fails.
+    with pytest.raises(OSError):
+        app.run_job(str(jobs_root / "gone"), str(in_path), "x.pdf", 9, None, {})
+    assert app.JOB_SLOTS.acquire(blocking=False)
+    assert not workdir.exists()
+
+
+def test_submit_removes_job_dir_when_save_fails(jobs_root, monkeypatch):
+    monkeypatch.setattr(app, "GS_BIN", "gs")
+    monkeypatch.setattr(app, "JOB_SLOTS", threading.BoundedSemaphore(1))
+
+    def save_upload(file_stream, path, hasher=None):
+        with open(path, "wb") as fh:
+            fh.write(b"%PDF")
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(app, "save_upload", save_upload)
+    response = app.app.test_client().post(
+        "/jobs",
+        data={"file": (io.BytesIO(b"%PDF-1.4\n"), "x.pdf")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 500
+    assert os.listdir(jobs_root) == []
+    assert app.JOB_SLOTS.acquire(blocking=False)
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def cache(tmp_path):
+    root = tmp_path / "cache"
+    root.mkdir()
+    return app.ResultCache(str(root), max_bytes=10)
+
+
+def put(cache, tmp_path, key, data, mtime=None):
+    src = tmp_path / f"{key}.src"
+    src.write_bytes(data)
+    cache.put(key, str(src))
+    if mtime is not None:
+        os.utime(cache._path(key), (mtime, mtime))
+
+
+def test_miss_leaves_no_file(cache, tmp_path):
+    dest = tmp_path / "out.pdf"
+    assert not cache.get("absent", str(dest))
+    assert not dest.exists()
+
+
+def test_hit_copies_entry_out(cache, tmp_path):
+    put(cache, tmp_path, "a", b"abcd")
+    dest = tmp_path / "out.pdf"
+    assert cache.get("a", str(dest))
+    assert dest.read_bytes() == b"abcd"
+
+
+def test_put_evicts_least_recently_used(cache, tmp_path):
+    put(cache, tmp_path, "a", b"aaaa", mtime=1000)
+    put(cache, tmp_path, "b", b"bbbb", mtime=2000)
+    # A hit makes "a" the most recently used entry.
+    assert cache.get("a", str(tmp_path / "out.pdf"))
+    put(cache, tmp_path, "c", b"cccc")
+    assert sorted(os.listdir(cache.root)) == ["a.pdf", "c.pdf"]
+
+
+def test_key_is_salted_with_version_and_gs(monkeypatch):
+    monkeypatch.setattr(app, "_gs_version", "10.00.0")
+    key = app.result_cache_key("d" * 40, 300, "/printer", None)
+    assert key.startswith("d" * 40 + "-300-printer-None-")
+
+    monkeypatch.setattr(app, "_gs_version", "10.05.1")
+    upgraded = app.result_cache_key("d" * 40, 300, "/printer", None)
+    monkeypatch.setattr(app, "CACHE_VERSION", app.CACHE_VERSION + 1)
+    bumped = app.result_cache_key("d" * 40, 300, "/printer", None)
+    assert len({key, upgraded, bumped}) == 3
+
+
+def test_key_is_none_without_gs_version(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_gs_version", None)
+    monkeypatch.setattr(app, "GS_BIN", str(tmp_path / "no-gs"))
+    assert app.result_cache_key("d" * 40, 300, "/printer", None) is None
+
+
+def test_compress_job_does_not_cache_empty_output(monkeypatch, tmp_path):
+    root = tmp_path / "cache"
+    root.mkdir()
+    monkeypatch.setattr(app, "RESULT_CACHE", app.ResultCache(str(root), max_bytes=1024))
+    monkeypatch.setattr(app, "_gs_version", "10.00.0")
+
+    def compress_file(in_path, tmpdir, filename, orig_bytes, target_size_mb, start_dpi, pdfsettings):
+        out_path = os.path.join(tmpdir, f"compressed_{filename}")
+        open(out_path, "wb").close()
+        return out_path
+
+    monkeypatch.setattr(app, "compress_file", compress_file)
+    opts = {"quality": "high", "target_size_mb": None, "start_dpi": 300, "pdfsettings": "/printer"}
+    app.compress_job(str(tmp_path / "input.pdf"), str(tmp_path), "x.pdf", 100, "d" * 40, opts)
+    assert os.listdir(root) == []
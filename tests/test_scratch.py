@@ -0,0 +1,22 @@
+import os
+import shutil
+
+import app
+
+
+def test_scratch_dir_uses_scratch_root_while_it_has_room(monkeypatch):
+    monkeypatch.setattr(app, "SCRATCH_MIN_FREE", 0)
+    path = app.make_scratch_dir()
+    try:
+        assert os.path.dirname(path) == app.SCRATCH_ROOT
+    finally:
+        shutil.rmtree(path)
+
+
+def test_scratch_dir_falls_back_to_disk_when_short_of_room(monkeypatch):
+    monkeypatch.setattr(app, "SCRATCH_MIN_FREE", float("inf"))
+    path = app.make_scratch_dir()
+    try:
+        assert os.path.dirname(path) == app.DISK_SCRATCH_ROOT
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,118 @@
+import io
+import os
+
+import pytest
+
+import app
+
+MB = 1024 * 1024
+
+
+def power_curve(size_at_300, exponent):
+    return lambda dpi: int(size_at_300 * (dpi / 300) ** exponent)
+
+
+def failing(dpi):
+    return None
+
+
+@pytest.fixture
+def stub_gs(monkeypatch):
+    """Replace gs with a size curve; records the DPIs of each round."""
+    rounds = []
+    monkeypatch.setattr(app, "GS_WORKERS", 4)
+
+    def install(curve):
+        def run_candidates(in_path, tmpdir, dpis, pdfsettings):
+            rounds.append(sorted(dpis))
+            return [(dpi, f"out_{dpi}.pdf", curve(dpi)) for dpi in dpis if curve(dpi) is not None]
+
+        monkeypatch.setattr(app, "run_candidates", run_candidates)
+        return rounds
+
+    return install
+
+
+@pytest.mark.parametrize("curve, start_dpi, target, expected_dpi, expected_rounds", [
+    # Already under target at the probe: nothing else to run.
+    (power_curve(2 * MB, 2), 300, 3 * MB, 300, [[300]]),
+    # Size really does follow dpi**2: the predicted DPI lands on target.
+    (power_curve(8 * MB, 2), 300, 2 * MB, 150, [[300], [150]]),
+    # Size follows dpi: the prediction undershoots, refinement recovers.
+    (power_curve(8 * MB, 1), 300, 4 * MB, 150, [[300], [212], [72, 100, 128, 156, 184], [133, 139, 144, 150]]),
+    # Even MIN_DPI is over target: settle for MIN_DPI.
+    (power_curve(100 * MB, 2), 300, 1 * MB, app.MIN_DPI, [[300], [app.MIN_DPI]]),
+])
+def test_search_target_dpi(stub_gs, curve, start_dpi, target, expected_dpi, expected_rounds):
+    rounds = stub_gs(curve)
+    dpi, out_path = app.search_target_dpi("in.pdf", "tmp", start_dpi, "/printer", target)
+    assert (dpi, out_path) == (expected_dpi, f"out_{expected_dpi}.pdf")
+    assert rounds == expected_rounds
+
+
+def test_search_target_dpi_all_runs_fail(stub_gs):
+    stub_gs(failing)
+    assert app.search_target_dpi("in.pdf", "tmp", 300, "/printer", MB) is None
+
+
+@pytest.mark.parametrize("value", ["abc", "nan", "inf", "-inf", "-1", "0"])
+def test_invalid_target_size_rejected(monkeypatch, value):
+    monkeypatch.setattr(app, "GS_BIN", "gs")
+    client = app.app.test_client()
+    response = client.post(
+        "/compress",
+        data={"file": (io.BytesIO(b"%PDF-1.4\n"), "x.pdf"), "targetSizeMB": value},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid targetSizeMB"}
+
+
+def test_search_target_dpi_keeps_only_best_candidate(monkeypatch, tmp_path):
+    def run_candidates(in_path, tmpdir, dpis, pdfsettings):
+        results = []
+        for dpi in dpis:
+            path = tmp_path / f"out_{dpi}.pdf"
+            path.write_bytes(b"x")
+            results.append((dpi, str(path), power_curve(8 * MB, 1)(dpi)))
+        return results
+
+    monkeypatch.setattr(app, "GS_WORKERS", 4)
+    monkeypatch.setattr(app, "run_candidates", run_candidates)
+    dpi, out_path = app.search_target_dpi("in.pdf", str(tmp_path), 300, "/printer", 4 * MB)
+    assert dpi == 150
+    assert os.listdir(tmp_path) == ["out_150.pdf"]
+
+
+def test_empty_candidates_are_dropped(monkeypatch, tmp_path):
+    def compress_with_gs(input_path, output_path, dpi, pdfsettings="/printer", timeout=app.DEFAULT_TIMEOUT):
+        with open(output_path, "wb") as fh:
+            fh.write(b"x" * (dpi - 150))
+
+    monkeypatch.setattr(app, "compress_with_gs", compress_with_gs)
+    results = app.run_candidates("in.pdf", str(tmp_path), [150, 200], "/printer")
+    assert [(dpi, size) for dpi, _, size in results] == [(200, 50)]
+
+
+def test_upload_named_like_a_candidate(monkeypatch, tmp_path):
+    def compress_with_gs(input_path, output_path, dpi, pdfsettings="/printer", timeout=app.DEFAULT_TIMEOUT):
+        # gs truncates its output before reading the input.
+        with open(output_path, "wb") as out:
+            with open(input_path, "rb") as src:
+                out.write(src.read()[:dpi])
+
+    monkeypatch.setattr(app, "GS_BIN", "gs")
+    monkeypatch.setattr(app, "RESULT_CACHE", None)
+    monkeypatch.setattr(app, "SCRATCH_ROOT", str(tmp_path))
+    monkeypatch.setattr(app, "SCRATCH_MIN_FREE", 0)
+    monkeypatch.setattr(app, "compress_with_gs", compress_with_gs)
+    upload = b"%PDF-1.4\n" + b"x" * 1000
+    with app.app.test_client().post(
+        "/compress",
+        data={"file": (io.BytesIO(upload), "out_300.pdf"), "quality": "high", "targetSizeMB": "0.0001"},
+        content_type="multipart/form-data",
+    ) as response:
+        assert response.status_code == 200
+        payload = response.get_json()
+    assert payload["filename"] == "compressed_out_300.pdf"
+    assert payload["metadata"]["compressedSize"] > 0